@@ -5,16 +5,27 @@ trade_tcl_ntp_safe.py
 Bybit trading run helper (NTP-based time patch + re-entrant safe).
 
 Features:
+- Detects fills from Bybit's private order WebSocket; REST polling is only a backed-off watchdog.
 - Applies NTP-based time offset (preferred) and falls back to Bybit endpoints if needed.
 - Patches time.time() and time.time_ns() for the duration of each run so HMAC timestamps align.
+- Places each account's three limits with one create-batch request (per-order fallback).
+- Per-account token-bucket rate limiting (short bursts pass, sustained load is paced).
+- Caches pybit HTTP sessions per (api_key, demo) so repeated runs reuse warm connections.
 - Safe to call trade_tcl(...) multiple times inside the same Python process: global runtime
-  state is cleared and all threads/sessions are cleaned up at the end of the run.
-- Treats Bybit retCode 34040 ("not modified") as success for TPSL setting.
-- Keeps debug logging similar to the original script.
+  state is cleared and all threads/streams are cleaned up at the end of the run.
+- Ctrl+C (SIGINT) or typing "cancel" cancels outstanding orders and closes positions; a second
+  Ctrl+C aborts immediately.
+- Attaches each limit's TP/SL to the order itself, so Bybit arms it the moment the order fills.
+- Keeps debug logging similar to the original script, routed through the "trade" logger
+  (QueueHandler -> QueueListener) so worker threads never block on stdout.
 
 Requirements:
     pip install ntplib requests pybit
 
+Optional:
+    pip install wsaccel   # C masking/UTF-8 validation; websocket-client (under pybit) uses it automatically
+    pip install orjson    # faster decoding of pybit WebSocket messages and REST responses (patched in at import)
+
 Usage:
     from trade_tcl_ntp_safe import trade_tcl
     trade_tcl(keys_dict, order_dict, tpsl_dict, demo=True)
@@ -23,28 +34,180 @@ Usage:
 
 import threading
 import time
-import uuid
+import itertools
+import random
 import queue
+import concurrent.futures
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import contextlib
 import hmac
 import hashlib
 import json
+import types
 import ntplib
-import traceback
 import gc
+import functools
+import heapq
+from dataclasses import dataclass, field
+from typing import Any
+from collections import defaultdict, deque
+import sys
+import os
+import signal
+import socket
+import selectors
+import logging
+from logging.handlers import QueueHandler, QueueListener
+
+try:
+    import msvcrt  # Windows console input (stdin can't be select()ed there)
+except ImportError:
+    msvcrt = None
+
+from pybit.unified_trading import HTTP, WebSocket  # your original import
+
+try:
+    import orjson  # optional: C JSON decoder for WebSocket frames and REST responses
+except ImportError:
+    orjson = None
+
+try:
+    from pybit import _websocket_stream as _pybit_ws_stream
+except ImportError:
+    _pybit_ws_stream = None
+
+
+def _install_fast_ws_json():
+    """
+    Make pybit decode incoming WebSocket frames with orjson when it is installed. Only pybit's
+    module-level `json` is swapped; dumps stays stdlib because pybit sends str frames.
+    """
+    if orjson is None or _pybit_ws_stream is None or not hasattr(_pybit_ws_stream, "json"):
+        return
+    _pybit_ws_stream.json = types.SimpleNamespace(loads=orjson.loads, dumps=json.dumps,
+                                                  JSONDecodeError=orjson.JSONDecodeError)
+
+
+_install_fast_ws_json()
+
+
+def _orjson_response_hook(response, *args, **kwargs):
+    """
+    requests response hook: decode the body with orjson (pybit's REST calls go through
+    response.json()). Malformed bodies fall back to requests' own json() so callers still
+    get the exception types they catch.
+    """
+    def fast_json(**kw):
+        try:
+            return orjson.loads(response.content)
+        except orjson.JSONDecodeError:
+            return requests.Response.json(response, **kw)
+    response.json = fast_json
+    return response
+
 
-from pybit.unified_trading import HTTP  # your original import
+def _install_fast_json_hook(http_session):
+    """Register the orjson response hook on a requests.Session (no-op without orjson)."""
+    if orjson is not None and _orjson_response_hook not in http_session.hooks["response"]:
+        http_session.hooks["response"].append(_orjson_response_hook)
 
 # ---------------------- CONFIG ----------------------
 RECV_WINDOW_MS = 600000  # 10 minutes
 NTP_SERVERS = ["pool.ntp.org", "time.google.com", "time.cloudflare.com"]
+LIMITS = (1, 2, 3)  # limit order numbers per account (order_dict qtyN/limitN, tpsl_dict tpN/slN)
+WS_FILLED_STATUSES = ("Filled", "PartiallyFilledCanceled")  # private order stream statuses treated as fills
+POLL_INTERVAL_MIN = 1.0   # REST poll interval while a WebSocket is down
+POLL_INTERVAL_MAX = 15.0  # reconciliation interval cap while WebSockets are healthy
+POSITION_RECONCILE_INTERVAL = 15.0  # REST position check interval while the position stream is live
+POSITION_POLL_INTERVAL = 1.0        # ... while it is down, or while REST lags behind a stream update
+FILL_WAIT_ACTIVE = 1.0    # tpsl_worker wake-up interval while orders are pending
+FILL_WAIT_IDLE = 30.0     # ... and while nothing is pending (no fill can arrive)
+WS_RECONNECT_MIN = 0.5    # first WebSocket reconnect delay (s), doubled per failed attempt
+WS_RECONNECT_MAX = 30.0   # reconnect delay cap (s)
+WS_RECONNECT_JITTER = 0.5 # random 0..jitter seconds added to each delay
+WS_STALE_AFTER = 35.0     # no frame (data or pong) for this long -> connection is treated as dead
+CONSOLE_POLL_INTERVAL = 0.1  # Windows console keyboard poll (stdin is not selectable there)
+
+# ---------------------- Logging ----------------------
+# Worker threads only enqueue log records; a QueueListener thread (started per run)
+# does the actual stdout I/O so a slow terminal/file never stalls the trading threads.
+logger = logging.getLogger("trade")
+logger.setLevel(logging.DEBUG)
+logger.propagate = False
+_log_queue = queue.SimpleQueue()  # unbounded, lock-free put for the producer threads
+logger.addHandler(QueueHandler(_log_queue))
+
+
+class _BatchedStreamHandler(logging.StreamHandler):
+    """StreamHandler that flushes only once the log queue is drained, so a burst becomes one write."""
+
+    def flush(self):
+        if _log_queue.empty():
+            super().flush()
+
+
+def _start_log_listener():
+    """Start the background thread draining the log queue to stdout. Caller must stop() it."""
+    handler = _BatchedStreamHandler(sys.stdout)
+    handler.setFormatter(logging.Formatter("%(message)s"))
+    listener = QueueListener(_log_queue, handler)
+    listener.start()
+    return listener
+
 
 # ---------------------- Global runtime/shared state ----------------------
-# Only a rate-limit map is global; it's cleared at the start of each run
-last_request_time = {}
+# Only the per-account rate-limit buckets are global; they're cleared at the start of each run
+RATE_LIMIT_CAPACITY = 10       # burst size per account (Bybit allows ~10 req/s/endpoint)
+RATE_LIMIT_FILL_TIME_S = 1.0   # seconds to refill an empty bucket (sustained rate = capacity / fill time)
 _state_lock = threading.RLock()
 
+# ---------------------- HTTP connection pooling ----------------------
+# Shared keep-alive session for the manual signed POSTs and public time endpoints,
+# so TCP+TLS handshakes are paid once per host instead of once per call.
+HTTP_POOL_MIN_SIZE = 32
+HTTP_KEEPALIVE_INTERVAL = 20.0  # seconds between warm-up GETs on the pooled connections during a run
+_rest_session = requests.Session()
+_install_fast_json_hook(_rest_session)
+_rest_pool_size = 0
+# orderLinkId suffixes: unique within the process; seeded from the clock so a restarted process
+# doesn't reuse the previous one's ids, and tagged with the pid so concurrent processes don't collide
+_order_seq = itertools.count(int(time.time() * 1000))
+_order_tag = f"{os.getpid() & 0xFFFF:04x}"
+
+# (api_key, demo, symbol) -> leverage confirmed by Bybit; kept across runs so repeat runs skip set_leverage
+_leverage_cache = {}
+
+# requests.Session shared by all cached pybit HTTP sessions (they only differ in per-request auth headers)
+_pybit_client = None
+
+
+def _mount_pool(http_session, pool_size, retry=True):
+    """
+    Mount a keep-alive HTTPS pool of `pool_size` connections on a requests.Session.
+    urllib3's Retry only re-sends idempotent methods by default, so order POSTs are never duplicated.
+    retry=False mounts the pool without it (pybit's client: pybit runs its own retry loop and
+    expects status errors from its own checks, not urllib3's RetryError).
+    """
+    adapter = HTTPAdapter(
+        pool_connections=pool_size,
+        pool_maxsize=pool_size,
+        max_retries=Retry(total=3, backoff_factor=0.3, status_forcelist=[429, 500, 502, 503, 504]) if retry else 0,
+    )
+    http_session.mount("https://", adapter)
+
+
+def _ensure_rest_pool(pool_size):
+    """Grow the shared REST session's pool if needed (keeps warm connections otherwise)."""
+    global _rest_pool_size
+    with _state_lock:
+        if pool_size > _rest_pool_size:
+            _mount_pool(_rest_session, pool_size)
+            if _pybit_client is not None:
+                _mount_pool(_pybit_client, pool_size, retry=False)
+            _rest_pool_size = pool_size
+
 # ---------------------- Time helpers ----------------------
 def _fetch_ntp_time_ms(servers=None, timeout=5):
     """Return time from NTP server in milliseconds, or None on failure."""
@@ -74,7 +237,7 @@ def _fetch_bybit_server_time_ms(demo=True, timeout=5):
     ]
     for url in candidates:
         try:
-            r = requests.get(url, timeout=timeout)
+            r = _rest_session.get(url, timeout=timeout)
             r.raise_for_status()
             j = r.json()
             server_ts = None
@@ -113,7 +276,7 @@ def use_ntp_time_patch(verbose=True, ntp_servers=None, demo_fallback=True):
 
     if server_ts is None:
         if verbose:
-            print("[time-patch] WARNING: could not fetch NTP/Bybit time; not patching time()")
+            logger.warning("[time-patch] WARNING: could not fetch NTP/Bybit time; not patching time()")
         yield False
         return
 
@@ -122,7 +285,7 @@ def use_ntp_time_patch(verbose=True, ntp_servers=None, demo_fallback=True):
     offset_s = offset_ms / 1000.0
 
     if verbose:
-        print(f"[time-patch] source={source} server_ms={server_ts}, local_ms={local_ts}, offset_ms={offset_ms}")
+        logger.info("[time-patch] source=%s server_ms=%s, local_ms=%s, offset_ms=%s", source, server_ts, local_ts, offset_ms)
 
     orig_time = time.time
     orig_time_ns = getattr(time, "time_ns", None)
@@ -146,33 +309,91 @@ def use_ntp_time_patch(verbose=True, ntp_servers=None, demo_fallback=True):
         if orig_time_ns is not None:
             time.time_ns = orig_time_ns
         if verbose:
-            print("[time-patch] restored original time() and time_ns()")
+            logger.info("[time-patch] restored original time() and time_ns()")
 
 
 # ---------------------- Rate limiting helper ----------------------
-def rate_limited_request(account_name, func, *args, **kwargs):
+class TokenBucket:
     """
-    Simple per-account 1 request/sec rate limiter.
-    Uses global last_request_time map which is reset at the start of each trade_tcl run.
+    Thread-safe token bucket: bursts of up to `capacity` calls pass immediately, an empty bucket
+    refills in `fill_time_s` seconds (capacity / fill_time_s calls/sec). Waiters are served in
+    arrival order and sleep outside the lock; each acquire reads the clock once.
     """
+
+    def __init__(self, capacity=RATE_LIMIT_CAPACITY, fill_time_s=RATE_LIMIT_FILL_TIME_S):
+        self.capacity = capacity
+        self.rate = capacity / fill_time_s
+        self.tokens = float(capacity)
+        self.last_refill = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.last_refill) * self.rate) - 1
+            self.last_refill = now
+            # a negative balance reserves a future token: sleep off the deficit once, no re-check
+            sleep_for = -self.tokens / self.rate if self.tokens < 0 else 0.0
+        if sleep_for:
+            time.sleep(sleep_for)
+
+
+# Bybit limits each endpoint separately, so calls are paced per (account, endpoint class).
+# Function name -> class; anything unlisted (pybit GETs like get_positions) is a "query".
+ENDPOINT_CLASSES = {
+    "place_order": "order",
+    "place_batch_order": "order",
+    "cancel_order": "order",
+    "cancel_all_orders": "order",
+    "cancel_batch_order": "order",
+    "set_leverage": "position",
+    "set_trading_stop": "position",
+}
+# class -> (capacity, fill_time_s) overriding the run's default bucket size
+ENDPOINT_RATE_LIMITS = {
+    "position": (5, 1.0),
+}
+
+# (account_name, endpoint class) -> TokenBucket; cleared at the start of each run
+buckets = {}
+_bucket_limits = (RATE_LIMIT_CAPACITY, RATE_LIMIT_FILL_TIME_S)
+
+
+def _get_bucket(account_name, func):
+    """Return the token bucket for the account and `func`'s endpoint class, creating it on first use."""
+    endpoint = ENDPOINT_CLASSES.get(getattr(func, "__name__", None), "query")
+    key = (account_name, endpoint)
     with _state_lock:
-        now = time.time()
-        last = last_request_time.get(account_name)
-        if last is not None:
-            elapsed = now - last
-            if elapsed < 1:
-                # sleep outside lock in small increments
-                sleep_for = 1 - elapsed
-                # release temporarily to avoid blocking other accounts
-                _state_lock.release()
-                try:
-                    time.sleep(sleep_for)
-                finally:
-                    _state_lock.acquire()
-        last_request_time[account_name] = time.time()
+        bucket = buckets.get(key)
+        if bucket is None:
+            bucket = buckets[key] = TokenBucket(*ENDPOINT_RATE_LIMITS.get(endpoint, _bucket_limits))
+    return bucket
+
+
+def rate_limited_request(account_name, func, *args, **kwargs):
+    """
+    Per-account, per-endpoint-class token-bucket rate limiter.
+    Uses the global `buckets` map which is reset at the start of each trade_tcl run.
+    """
+    _get_bucket(account_name, func).acquire()
     return func(*args, **kwargs)
 
 
+def _make_limited(account_name, func):
+    """
+    Pre-bind `func` to its bucket: the returned callable is rate_limited_request(account_name, func, ...)
+    without the per-call class lookup. Only valid for the current run (buckets are reset per run).
+    """
+    acquire = _get_bucket(account_name, func).acquire
+
+    def call(*args, **kwargs):
+        acquire()
+        return func(*args, **kwargs)
+
+    call.__name__ = func.__name__
+    return call
+
+
 # ---------------------- Signature helper ----------------------
 def _make_signature(api_key, api_secret, recv_window, timestamp_ms, body_json):
     payload = f"{timestamp_ms}{api_key}{recv_window}{body_json}"
@@ -198,7 +419,7 @@ def signed_post(base_url, api_key, api_secret, path, body, recv_window_ms=RECV_W
     }
 
     url = base_url.rstrip("/") + path
-    resp = requests.post(url, headers=headers, data=body_json, timeout=timeout)
+    resp = _rest_session.post(url, headers=headers, data=body_json, timeout=timeout)
     try:
         return resp.json()
     except ValueError:
@@ -212,9 +433,18 @@ def make_account_actions(api_key, api_secret, demo=True, recv_window_ms=RECV_WIN
     def place_order(body):
         return signed_post(base, api_key, api_secret, "/v5/order/create", body, recv_window_ms)
 
+    def place_batch_order(body):
+        return signed_post(base, api_key, api_secret, "/v5/order/create-batch", body, recv_window_ms)
+
     def cancel_order(body):
         return signed_post(base, api_key, api_secret, "/v5/order/cancel", body, recv_window_ms)
 
+    def cancel_all_orders(body):
+        return signed_post(base, api_key, api_secret, "/v5/order/cancel-all", body, recv_window_ms)
+
+    def cancel_batch_order(body):
+        return signed_post(base, api_key, api_secret, "/v5/order/cancel-batch", body, recv_window_ms)
+
     def set_trading_stop(body):
         return signed_post(base, api_key, api_secret, "/v5/position/trading-stop", body, recv_window_ms)
 
@@ -223,65 +453,212 @@ def make_account_actions(api_key, api_secret, demo=True, recv_window_ms=RECV_WIN
 
     return {
         "place_order": place_order,
+        "place_batch_order": place_batch_order,
         "cancel_order": cancel_order,
+        "cancel_all_orders": cancel_all_orders,
+        "cancel_batch_order": cancel_batch_order,
         "set_trading_stop": set_trading_stop,
         "set_leverage": set_leverage,
         "base_url": base,
     }
 
 
+@functools.lru_cache(maxsize=128)
+def get_http(api_key, api_secret, demo=True):
+    """
+    Return a pybit HTTP session for the account, cached across trade_tcl runs so later runs
+    reuse its pooled keep-alive connections instead of paying TCP+TLS setup again.
+    """
+    try:
+        session = HTTP(api_key=api_key, api_secret=api_secret, demo=demo, recv_window=RECV_WINDOW_MS)
+    except TypeError:
+        session = HTTP(api_key=api_key, api_secret=api_secret, testnet=demo, recv_window=RECV_WINDOW_MS)
+    # pybit keeps its requests.Session in `.client`: the first one gets a pooled adapter and is then
+    # shared, so every account's GETs reuse the same warm connections to the (single) API host
+    global _pybit_client
+    client = getattr(session, "client", None)
+    if isinstance(client, requests.Session):
+        with _state_lock:
+            if _pybit_client is None:
+                _mount_pool(client, max(HTTP_POOL_MIN_SIZE, _rest_pool_size), retry=False)
+                _install_fast_json_hook(client)
+                _pybit_client = client
+            else:
+                session.client = _pybit_client
+    return session
+
+
+def open_private_ws(api_key, api_secret, demo=True):
+    """
+    Open a pybit private WebSocket (order/position topics) for one account. pybit's own
+    reconnect-on-error is disabled: trade_tcl reconnects itself, and two reconnect paths would
+    leave the replaced socket resubscribed behind our back.
+    """
+    try:
+        return WebSocket(testnet=False, demo=demo, channel_type="private", api_key=api_key, api_secret=api_secret,
+                         restart_on_error=False)
+    except TypeError:
+        return WebSocket(testnet=demo, channel_type="private", api_key=api_key, api_secret=api_secret,
+                         restart_on_error=False)
+
+
+def tune_ws_socket(ws):
+    """
+    Disable Nagle (and delayed ACKs on Linux) on a pybit WebSocket's TCP socket so small fill
+    frames and pongs aren't held back in the kernel. Best-effort: pybit internals may differ.
+    """
+    try:
+        sock = ws.ws.sock.sock  # pybit WebSocket -> WebSocketApp -> websocket.WebSocket -> socket
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        if hasattr(socket, "TCP_QUICKACK"):
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_QUICKACK, 1)
+    except (AttributeError, OSError) as e:
+        logger.debug("[DEBUG] Could not tune WebSocket socket: %s", e)
+
+
+def watch_ws_activity(ws, on_activity):
+    """
+    Call on_activity() for every frame pybit's WebSocket receives, including its custom pongs
+    (which never reach the stream callbacks) and protocol-level pongs. Returns False if pybit's
+    internals don't allow it.
+    """
+    on_message = getattr(ws, "_on_message", None)
+    on_pong = getattr(ws, "_on_pong", None)
+    if not callable(on_message) or not callable(on_pong):
+        return False
+
+    # pybit's WebSocketApp handlers look these up on the instance at call time
+    def _on_message(message):
+        on_activity()
+        return on_message(message)
+
+    def _on_pong():
+        on_activity()
+        return on_pong()
+
+    ws._on_message = _on_message
+    ws._on_pong = _on_pong
+    return True
+
+
 # ---------------------- Safe runtime reset ----------------------
-def reset_runtime_state():
+def reset_runtime_state(rate_capacity=RATE_LIMIT_CAPACITY, rate_fill_time_s=RATE_LIMIT_FILL_TIME_S):
     """Clear global runtime maps and attempt to encourage GC so leftover sessions/threads are freed."""
-    global last_request_time
+    global _bucket_limits
     with _state_lock:
-        last_request_time.clear()
+        buckets.clear()
+        _bucket_limits = (rate_capacity, rate_fill_time_s)
     # Attempt garbage collection - helpful if some objects reference requests sessions
     try:
         gc.collect()
     except Exception:
         pass
-    print("[DEBUG] reset_runtime_state(): cleared global runtime maps and ran GC.")
+    logger.debug("[DEBUG] reset_runtime_state(): cleared global runtime maps and ran GC.")
 
 
 # ---------------------- Helper to fetch open orders (as before) ----------------------
+OPEN_ORDER_METHODS = (
+    "get_open_orders",
+    "query_active_order",
+    "get_active_order",
+    "query_order",
+    "get_order_list",
+    "get_open_order",
+    "get_orders",
+    "get_order_history",
+)
+ORDER_HISTORY_METHODS = ("get_order_history", "query_order", "query_active_order", "get_orders")
+ORDER_LINK_ID_DUPLICATE = 110072  # retCode: an order with this orderLinkId already exists
+ORDER_HISTORY_LIMIT = 50  # most recent orders fetched per history query (Bybit v5 maximum)
+
+# pybit's HTTP methods come from its class, not the instance, so lookups are resolved once per
+# client class and shared by every account's session.
+@functools.cache
+def _find_method(session_cls, names):
+    """First name in `names` that is callable on `session_cls`, or None."""
+    return next((n for n in names if callable(getattr(session_cls, n, None))), None)
+
+
+# type(session) -> open-order method that returned a recognised response shape
+_open_order_methods = {}
+
+
+def resolve_session_method(session, names):
+    """Return the first callable attribute of `session` among `names` (resolved per class), or None."""
+    name = _find_method(type(session), names)
+    return getattr(session, name) if name else None
+
+
+def _result_list(resp):
+    """Return resp["result"]["list"] (or ["data"], or a bare result list); () when absent, without allocating fallbacks."""
+    result = resp.get("result") if isinstance(resp, dict) else None
+    if isinstance(result, dict):
+        return result.get("list") or result.get("data") or ()
+    return result if isinstance(result, list) else ()
+
+
+_OPP = {"Buy": "Sell", "Sell": "Buy"}  # position side -> closing order side
+_FLAT_SIZES = frozenset(("0", "0.0", "0.00", "", None))
+
+
+def _position_size(row):
+    """Position size as float; the common flat strings skip float() entirely, unparsable -> 0.0."""
+    size = row.get("size")
+    if size in _FLAT_SIZES:
+        return 0.0
+    try:
+        return float(size)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def _normalize_order_list(resp):
+    """Extract the order list from common response shapes; None if the shape is unrecognised."""
+    if isinstance(resp, dict):
+        result = resp.get("result")
+        if isinstance(result, dict):
+            if "list" in result and isinstance(result["list"], list):
+                return result["list"]
+            if "data" in result and isinstance(result["data"], list):
+                return result["data"]
+        if isinstance(result, list):
+            return result
+        if "data" in resp and isinstance(resp["data"], list):
+            return resp["data"]
+    if isinstance(resp, list):
+        return resp
+    return None
+
+
 def fetch_open_orders_safe(session, symbol):
     """
     Try several common pybit method names to obtain open/active orders.
     Returns a list (possibly empty) of order dicts.
+    The first working method is remembered per session class, so later calls go straight to it.
     Raises exception if none of the method calls work (bubbles last exception).
     """
-    candidates = [
-        "get_open_orders",
-        "query_active_order",
-        "get_active_order",
-        "query_order",
-        "get_order_list",
-        "get_open_order",
-        "get_orders",
-        "get_order_history",
-    ]
+    session_cls = type(session)
+    cached = _open_order_methods.get(session_cls)
+    if cached is not None:
+        try:
+            orders = _normalize_order_list(getattr(session, cached)(category="linear", symbol=symbol))
+            if orders is not None:
+                return orders
+        except (AttributeError, TypeError):
+            pass
+        # method vanished or changed shape: forget it and rediscover below
+        _open_order_methods.pop(session_cls, None)
+
     last_exc = None
-    for name in candidates:
+    for name in OPEN_ORDER_METHODS:
         fn = getattr(session, name, None)
         if not callable(fn):
             continue
         try:
-            resp = fn(category="linear", symbol=symbol)
-            # Normalize common response shapes
-            if isinstance(resp, dict):
-                result = resp.get("result")
-                if isinstance(result, dict):
-                    if "list" in result and isinstance(result["list"], list):
-                        return result["list"]
-                    if "data" in result and isinstance(result["data"], list):
-                        return result["data"]
-                if isinstance(result, list):
-                    return result
-                if "data" in resp and isinstance(resp["data"], list):
-                    return resp["data"]
-            if isinstance(resp, list):
-                return resp
+            orders = _normalize_order_list(fn(category="linear", symbol=symbol))
+            if orders is not None:
+                _open_order_methods[session_cls] = name
+                return orders
         except Exception as e:
             last_exc = e
             continue
@@ -290,8 +667,47 @@ def fetch_open_orders_safe(session, symbol):
     raise AttributeError("No supported open-order fetch method found on session")
 
 
+# ---------------------- Per-account run state ----------------------
+@dataclass(slots=True)
+class AccountState:
+    """Everything trade_tcl tracks for one account during a run (one object instead of parallel dicts)."""
+    session: Any = None                                     # pybit HTTP session (GETs)
+    actions: dict = field(default_factory=dict)             # manual signed POST wrappers
+    calls: dict = field(default_factory=dict)               # rate-limited hot calls (actions + get_positions) for this run
+    ws: Any = None                                          # private WebSocket (order/position streams)
+    reconnect_ws: Any = None                                # callable reopening ws (set during setup)
+    ws_backoff: float = WS_RECONNECT_MIN                    # next reconnect delay (doubles up to WS_RECONNECT_MAX)
+    ws_retry_at: float = 0.0                                # time.monotonic() of the next reconnect (0.0 = none due)
+    ws_last_seen: float = 0.0                               # time.monotonic() of the last received frame (0.0 = untracked)
+    results: list = field(default_factory=list)             # placed orders [{"orderId": ..., "orderLinkId": ...}]
+    link_to_limit: dict = field(default_factory=dict)       # orderLinkId -> limit number
+    order_index: dict = field(default_factory=dict)         # exchange orderId -> orderLinkId
+    pending: set = field(default_factory=set)               # orderLinkIds placed and not yet filled/canceled
+    in_flight: set = field(default_factory=set)             # fills claimed but not yet handled by tpsl_worker
+    processed: set = field(default_factory=set)             # fills already handled by tpsl_worker
+    lock: threading.RLock = field(default_factory=threading.RLock)  # guards pending/summary consistency
+    deadline: float = 0.0                                   # time.monotonic() timeout once placed (0.0 = never placed)
+    active_position: bool = False                           # TP/SL set and position being monitored
+    position_opened: bool = False                           # REST confirmed the monitored position opened
+    position_check_at: float = 0.0                          # time.monotonic() of the next REST position check
+    position_ready: threading.Event = field(default_factory=threading.Event)  # position stream: size > 0 seen
+    position_closed: threading.Event = field(default_factory=threading.Event)  # position stream: back to 0 after that
+    future: concurrent.futures.Future = field(default_factory=concurrent.futures.Future)  # resolved when done
+    # summary fields returned to the caller
+    filled: list = field(default_factory=list)
+    canceled: list = field(default_factory=list)
+    timeout: bool = False
+    done: bool = False
+    user_cancel: bool = False
+
+    def summary(self):
+        return {"filled": list(self.filled), "canceled": list(self.canceled), "timeout": self.timeout,
+                "done": self.done, "user_cancel": self.user_cancel}
+
+
 # ---------------------- Main run (re-entrant) ----------------------
-def trade_tcl(keys_dict, order_dict, tpsl_dict, demo=True, max_wait_seconds=300):
+def trade_tcl(keys_dict, order_dict, tpsl_dict, demo=True, max_wait_seconds=300,
+              rate_capacity=RATE_LIMIT_CAPACITY, rate_fill_time_s=RATE_LIMIT_FILL_TIME_S):
     """
     Main trading function (safe to call repeatedly in the same interpreter).
 
@@ -299,9 +715,22 @@ def trade_tcl(keys_dict, order_dict, tpsl_dict, demo=True, max_wait_seconds=300)
     order_dict: {"coin":"BTCUSDT","side":"Buy","leverage":..,"qty1":..,"limit1":..,...}
     tpsl_dict: {"symbol":"BTCUSDT","tp1":..,"sl1":..,...}
     demo: True -> use Bybit demo endpoints
+    rate_capacity / rate_fill_time_s: token bucket burst size and refill time per account and endpoint
+        class (classes listed in ENDPOINT_RATE_LIMITS keep their own limits)
     """
+    log_listener = _start_log_listener()
+    try:
+        return _trade_tcl_run(keys_dict, order_dict, tpsl_dict, demo, max_wait_seconds,
+                              rate_capacity, rate_fill_time_s)
+    finally:
+        # drains everything still queued before returning to the caller
+        log_listener.stop()
+        sys.stdout.flush()
+
+
+def _trade_tcl_run(keys_dict, order_dict, tpsl_dict, demo, max_wait_seconds, rate_capacity, rate_fill_time_s):
     # Reset global runtime state for a clean run
-    reset_runtime_state()
+    reset_runtime_state(rate_capacity, rate_fill_time_s)
 
     # Informational check: NTP vs local drift (best-effort)
     try:
@@ -309,301 +738,633 @@ def trade_tcl(keys_dict, order_dict, tpsl_dict, demo=True, max_wait_seconds=300)
         local_ts = int(time.time() * 1000)
         if ntp_ts is not None:
             drift = local_ts - ntp_ts
-            print(f"[INFO] Local ms: {local_ts} | NTP ms: {ntp_ts} | drift (local - server) = {drift} ms")
+            logger.info("[INFO] Local ms: %s | NTP ms: %s | drift (local - server) = %s ms", local_ts, ntp_ts, drift)
             if abs(drift) > RECV_WINDOW_MS:
-                print(f"[WARN] Absolute drift ({abs(drift)} ms) exceeds recv_window ({RECV_WINDOW_MS} ms).")
+                logger.warning("[WARN] Absolute drift (%s ms) exceeds recv_window (%s ms).", abs(drift), RECV_WINDOW_MS)
         else:
             bybit_ts = _fetch_bybit_server_time_ms(demo=demo)
             if bybit_ts is not None:
                 drift = local_ts - bybit_ts
-                print(f"[INFO] Local ms: {local_ts} | Bybit ms: {bybit_ts} | drift (local - server) = {drift} ms (NTP unavailable)")
+                logger.info("[INFO] Local ms: %s | Bybit ms: %s | drift (local - server) = %s ms (NTP unavailable)", local_ts, bybit_ts, drift)
             else:
-                print("[INFO] Could not determine authoritative server time before start.")
+                logger.info("[INFO] Could not determine authoritative server time before start.")
     except Exception:
-        print("[INFO] Time check failed (exception). Continuing.")
+        logger.info("[INFO] Time check failed (exception). Continuing.")
+
+    # per-limit values resolved once, indexed by limit number - 1 (no f-string key builds on hot paths)
+    symbol = tpsl_dict["symbol"]
+    coin = order_dict["coin"]
+    side = order_dict["side"]
+    qtys = tuple(str(order_dict[f"qty{i}"]) for i in LIMITS)
+    prices = tuple(str(order_dict[f"limit{i}"]) for i in LIMITS)
+    tps = tuple(tpsl_dict.get(f"tp{i}") for i in LIMITS)
+    sls = tuple(tpsl_dict.get(f"sl{i}") for i in LIMITS)
+
+    # size the shared REST pool to cover concurrent place+poll+tpsl threads per account
+    pool_size = max(HTTP_POOL_MIN_SIZE, 2 * len(keys_dict) * 3)
+    _ensure_rest_pool(pool_size)
 
     # Use authoritative time for the duration of the run
     with use_ntp_time_patch(verbose=True, ntp_servers=NTP_SERVERS, demo_fallback=True):
         # Per-run local state (guaranteed fresh each call)
-        results = {}   # per-account placed orders list of {"orderLinkId":...}
-        sessions = {}  # per-account HTTP (pybit) session
-        actions = {}   # per-account manual POST actions (place/cancel/set)
-        final_summary = {acc: {"filled": [], "canceled": [], "timeout": False, "done": False, "user_cancel": False}
-                         for acc in keys_dict.keys()}
-        order_timestamps = {}
-        cancel_requested = {"flag": False}
+        states = {acc: AccountState() for acc in keys_dict.keys()}
         stop_event = threading.Event()
 
-        # per-account mapping orderLinkId -> limit number
-        orderlinkid_to_limit = {acc: {} for acc in keys_dict.keys()}
-        pending_orderlinks = {acc: set() for acc in keys_dict.keys()}
+        # cancel_future is a sentinel resolved on user cancel (SIGINT / "cancel" on stdin)
+        cancel_future = concurrent.futures.Future()
 
-        # processed markers to avoid duplicate handling
-        processed_fills = {acc: set() for acc in keys_dict.keys()}
+        # run-wide lock for cross-account state (cancel request); per-account state uses AccountState.lock
+        lock = threading.RLock()
 
-        # flag indicating account currently has a monitored active position (TP/SL set)
-        active_position_flag = {acc: False for acc in keys_dict.keys()}
+        # fill events (account, orderLinkId) handed from the order stream / watchdog to tpsl_worker
+        fill_events = deque()
+        fill_cond = threading.Condition()
 
-        # lock for modifying shared structures safely
-        lock = threading.RLock()
+        # accounts handed to positions_worker; position_cv also guards each state's position_check_at
+        monitored = set()
+        position_cv = threading.Condition()
 
-        fill_events = queue.Queue()
+        def push_fill(account_name, order_link):
+            with fill_cond:
+                fill_events.append((account_name, order_link))
+                fill_cond.notify()
+
+        def wait_fills(timeout):
+            """Wait up to `timeout` seconds for fill events and drain all of them. [] on timeout or stop."""
+            with fill_cond:
+                fill_cond.wait_for(lambda: fill_events or stop_event.is_set(), timeout=timeout)
+                if stop_event.is_set():
+                    return []
+                batch = list(fill_events)
+                fill_events.clear()
+                return batch
+
+        def mark_done(account_name, **flags):
+            """Latch the account as done (plus any summary flags) and resolve its future once."""
+            st = states[account_name]
+            with st.lock:
+                if st.done:
+                    return
+                for name, value in flags.items():
+                    setattr(st, name, value)
+                st.done = True
+                st.future.set_result(st.summary())
+
+        def claim_fill(account_name, order_link):
+            """Move a pending link to the fill queue. False if it was already claimed (ws, poll or history)."""
+            st = states[account_name]
+            with st.lock:
+                if order_link not in st.pending:
+                    return False
+                st.pending.discard(order_link)
+                st.in_flight.add(order_link)
+            push_fill(account_name, order_link)
+            return True
+
+        def on_order(account_name, msg):
+            """Private order-stream callback: enqueue TPSL handling for tracked fills."""
+            order_index = states[account_name].order_index
+            for row in msg.get("data") or ():
+                if row.get("orderStatus") not in WS_FILLED_STATUSES:
+                    continue
+                # rows normally carry our orderLinkId; fall back to the placed orderId
+                order_link = row.get("orderLinkId") or order_index.get(row.get("orderId"))
+                if not claim_fill(account_name, order_link):
+                    continue
+                logger.debug("[DEBUG] [%s] (ws) Order %s filled (status=%s).", account_name, order_link, row.get("orderStatus"))
+
+        def on_position(account_name, msg):
+            """Private position-stream callback: signal position_ready on size > 0 and position_closed on the return to 0."""
+            st = states[account_name]
+            for row in msg.get("data") or ():
+                if row.get("symbol") != symbol:
+                    continue
+                with position_cv:
+                    if _position_size(row) > 0:
+                        st.position_closed.clear()
+                        st.position_ready.set()
+                    elif st.position_ready.is_set():
+                        st.position_closed.set()
+                    st.position_check_at = 0.0  # confirm over REST now
+                    position_cv.notify_all()
+
+        def maybe_mark_done(account_name):
+            """Mark the account done if it has no pending orders, unhandled fills or monitored position."""
+            st = states[account_name]
+            with st.lock:
+                if not st.pending and not st.in_flight and not st.active_position:
+                    mark_done(account_name)
 
         # ---------- Place Orders ----------
-        def place_orders(account_name, creds):
-            print(f"[DEBUG] [{account_name}] Initializing HTTP session (recv_window={RECV_WINDOW_MS})...")
-            # keep pybit session for GETs
+        def setup_account(account_name, creds):
+            """Create the account's sessions/streams and set leverage. Returns True if orders can be placed."""
             try:
-                session = HTTP(api_key=creds["api_key"], api_secret=creds["api_secret"], demo=demo, recv_window=RECV_WINDOW_MS)
-            except TypeError:
-                session = HTTP(api_key=creds["api_key"], api_secret=creds["api_secret"], testnet=demo, recv_window=RECV_WINDOW_MS)
-            sessions[account_name] = session
-            actions[account_name] = make_account_actions(creds["api_key"], creds["api_secret"], demo=demo, recv_window_ms=RECV_WINDOW_MS)
-
-            # set leverage via signed manual POST (pybit's POST had issues)
+                _setup_account(account_name, creds)
+                return True
+            except Exception as e:
+                logger.warning("[%s] ⚠️ Account setup failed, skipping placement: %s", account_name, e)
+                return False
+
+        def touch_ws(st):
+            st.ws_last_seen = time.monotonic()
+
+        def connect_ws(account_name, creds):
+            """
+            (Re)open the account's private stream and subscribe. On failure the next attempt is scheduled
+            with capped exponential back-off plus jitter; a success resets the back-off.
+            """
+            st = states[account_name]
             try:
-                lev_body = {
-                    "category": "linear",
-                    "symbol": order_dict["coin"],
-                    "buyLeverage": str(order_dict["leverage"]),
-                    "sellLeverage": str(order_dict["leverage"])
-                }
-                rate_limited_request(account_name, actions[account_name]["set_leverage"], lev_body)
+                ws = open_private_ws(creds["api_key"], creds["api_secret"], demo=demo)
+                ws.order_stream(callback=lambda msg, acc=account_name: on_order(acc, msg))
+                ws.position_stream(callback=lambda msg, acc=account_name: on_position(acc, msg))
+                tune_ws_socket(ws)
+                st.ws_last_seen = time.monotonic() if watch_ws_activity(ws, functools.partial(touch_ws, st)) else 0.0
             except Exception as e:
-                print(f"[{account_name}] ⚠️ Error setting leverage (manual): {e}")
-
-            results[account_name] = []
-            order_timestamps[account_name] = time.time()
-
-            for i in range(1, 4):
-                order_link_id = f"{account_name}_limit{i}_{uuid.uuid4().hex[:8]}"
+                delay = st.ws_backoff + random.random() * WS_RECONNECT_JITTER
+                st.ws_retry_at = time.monotonic() + delay
+                st.ws_backoff = min(st.ws_backoff * 2, WS_RECONNECT_MAX)
+                logger.warning("[%s] ⚠️ WebSocket unavailable (retry in %.1fs), using REST polling: %s", account_name, delay, e)
+                return False
+            old_ws, st.ws = st.ws, ws
+            st.ws_retry_at = 0.0
+            # only a live socket resets the back-off; one that drops straight away keeps escalating it
+            st.ws_backoff = WS_RECONNECT_MIN if ws.is_connected() else min(st.ws_backoff * 2, WS_RECONNECT_MAX)
+            if old_ws is not None:
+                try:
+                    old_ws.exit()
+                except Exception:
+                    pass
+            return True
+
+        def _setup_account(account_name, creds):
+            st = states[account_name]
+            logger.debug("[DEBUG] [%s] Initializing HTTP session (recv_window=%s)...", account_name, RECV_WINDOW_MS)
+            # keep pybit session for GETs (reused across runs)
+            st.session = get_http(creds["api_key"], creds["api_secret"], demo)
+            st.actions = make_account_actions(creds["api_key"], creds["api_secret"], demo=demo, recv_window_ms=RECV_WINDOW_MS)
+            st.calls = {name: _make_limited(account_name, fn) for name, fn in st.actions.items() if callable(fn)}
+            st.calls["get_positions"] = _make_limited(account_name, st.session.get_positions)
+
+            # subscribe to the private order stream before placing so no fill can be missed;
+            # polling_worker falls back to REST (and reconnects) while the socket is down
+            st.reconnect_ws = functools.partial(connect_ws, account_name, creds)
+            connect_ws(account_name, creds)
+
+            # set leverage via signed manual POST (pybit's POST had issues), unless an earlier run already did
+            leverage = str(order_dict["leverage"])
+            lev_key = (creds["api_key"], demo, coin)
+            if _leverage_cache.get(lev_key) == leverage:
+                logger.debug("[DEBUG] [%s] Leverage already %sx, skipping set_leverage.", account_name, leverage)
+            else:
                 try:
-                    body = {
+                    lev_body = {
                         "category": "linear",
-                        "symbol": order_dict["coin"],
-                        "side": order_dict["side"],
-                        "orderType": "Limit",
-                        "qty": str(order_dict[f"qty{i}"]),
-                        "price": str(order_dict[f"limit{i}"]),
-                        "timeInForce": "GTC",
-                        "orderLinkId": order_link_id
+                        "symbol": coin,
+                        "buyLeverage": leverage,
+                        "sellLeverage": leverage
                     }
-                    resp = rate_limited_request(account_name, actions[account_name]["place_order"], body)
-                    # check success (Bybit v5 typical success is retCode == 0)
-                    if isinstance(resp, dict) and resp.get("retCode") == 0:
-                        with lock:
-                            results[account_name].append({"orderLinkId": order_link_id})
-                            orderlinkid_to_limit[account_name][order_link_id] = i
-                            pending_orderlinks[account_name].add(order_link_id)
-                        print(f"[{account_name}] 📌 Limit{i} placed (orderLinkId={order_link_id}) @ {order_dict[f'limit{i}']}")
+                    resp = st.calls["set_leverage"](lev_body)
+                    # 110043 = "leverage not modified": already set, same as success
+                    if isinstance(resp, dict) and resp.get("retCode") in (0, 110043):
+                        with _state_lock:
+                            _leverage_cache[lev_key] = leverage
                     else:
-                        print(f"[{account_name}] ⚠️ Error placing Limit{i} (manual): {resp}")
+                        logger.warning("[%s] ⚠️ set_leverage failed: %s", account_name, resp)
                 except Exception as e:
-                    print(f"[{account_name}] ⚠️ Exception placing Limit{i}: {e}")
-                # respect 1 req/sec between placement calls (rate_limited_request will throttle but keep small sleep)
-                time.sleep(1)
-
-        # run placement for all accounts in parallel (join before continuing)
-        place_threads = []
-        for acc, creds in keys_dict.items():
-            t = threading.Thread(target=place_orders, args=(acc, creds), name=f"place_{acc}", daemon=False)
-            place_threads.append(t)
-            t.start()
-        for t in place_threads:
-            t.join()
-
-        print("[DEBUG] ✅ All accounts placed orders.")
-
-        # ---------- TPSL Worker: sets TP/SL when a tracked orderLinkId fills ----------
-        def tpsl_worker():
-            while not stop_event.is_set():
-                try:
-                    account_name, order_link_id = fill_events.get(timeout=1)
-                except queue.Empty:
-                    continue
+                    logger.warning("[%s] ⚠️ Error setting leverage (manual): %s", account_name, e)
+
+            with st.lock:
+                st.deadline = time.monotonic() + max_wait_seconds
+
+        def limit_request(i, order_link_id):
+            request = {
+                "symbol": coin,
+                "side": side,
+                "orderType": "Limit",
+                "qty": qtys[i - 1],
+                "price": prices[i - 1],
+                "timeInForce": "GTC",
+                "orderLinkId": order_link_id
+            }
+            # TP/SL travels with the order: the exchange arms it on fill, no set_trading_stop round-trip
+            tp, sl = tps[i - 1], sls[i - 1]
+            if tp is not None and sl is not None:
+                request.update(takeProfit=str(tp), stopLoss=str(sl), tpslMode="Full",
+                               tpOrderType="Market", slOrderType="Market")
+            return request
+
+        def track_link(account_name, i):
+            """Register a fresh orderLinkId for limit `i` as pending and return it."""
+            st = states[account_name]
+            order_link_id = f"{account_name}_limit{i}_{_order_tag}{next(_order_seq) & 0xFFFFFFFF:08x}"
+            # track the link before sending, so a WS fill racing the REST response isn't dropped
+            with st.lock:
+                st.link_to_limit[order_link_id] = i
+                st.pending.add(order_link_id)
+            return order_link_id
+
+        def record_placed(account_name, i, order_link_id, order_id):
+            st = states[account_name]
+            with st.lock:
+                st.results.append({"orderId": order_id, "orderLinkId": order_link_id})
+                if order_id:
+                    st.order_index[order_id] = order_link_id
+            logger.info("[%s] 📌 Limit%s placed (orderLinkId=%s) @ %s", account_name, i, order_link_id, prices[i - 1])
+
+        def place_one(account_name, i, order_link_id):
+            """Place limit order `i` on its own (fallback when the batch request fails); untrack it on failure."""
+            st = states[account_name]
+            placed = False
+            try:
+                body = {"category": "linear", **limit_request(i, order_link_id)}
+                resp = st.calls["place_order"](body)
+                # check success (Bybit v5 typical success is retCode == 0)
+                if isinstance(resp, dict) and resp.get("retCode") == 0:
+                    placed = True
+                    record_placed(account_name, i, order_link_id, (resp.get("result") or {}).get("orderId"))
+                elif isinstance(resp, dict) and resp.get("retCode") == ORDER_LINK_ID_DUPLICATE:
+                    # the failed batch did reach the exchange: the order is live, keep tracking it by link
+                    placed = True
+                    record_placed(account_name, i, order_link_id, None)
+                else:
+                    logger.warning("[%s] ⚠️ Error placing Limit%s (manual): %s", account_name, i, resp)
+            except Exception as e:
+                logger.warning("[%s] ⚠️ Exception placing Limit%s: %s", account_name, i, e)
+            if not placed:
+                with st.lock:
+                    st.link_to_limit.pop(order_link_id, None)
+                    st.pending.discard(order_link_id)
+
+        def place_account(account_name):
+            """Place limits 1..3 with one create-batch request; legs the batch didn't place are sent one by one."""
+            st = states[account_name]
+            links = {i: track_link(account_name, i) for i in LIMITS}
+            retry = list(links)
+            try:
+                body = {"category": "linear", "request": [limit_request(i, link) for i, link in links.items()]}
+                resp = st.calls["place_batch_order"](body)
+                if isinstance(resp, dict) and resp.get("retCode") == 0:
+                    # per-leg outcome: result.list and retExtInfo.list are in request order
+                    placed = _result_list(resp)
+                    codes = (resp.get("retExtInfo") or {}).get("list") or ()
+                    retry = []
+                    for n, (i, link) in enumerate(links.items()):
+                        code = codes[n].get("code") if n < len(codes) else 0
+                        if code == 0 and n < len(placed):
+                            record_placed(account_name, i, link, placed[n].get("orderId"))
+                        else:
+                            logger.warning("[%s] ⚠️ Batch rejected Limit%s: %s", account_name, i, codes[n] if n < len(codes) else resp)
+                            retry.append(i)
+                else:
+                    logger.warning("[%s] ⚠️ Batch placement failed, placing orders one by one: %s", account_name, resp)
+            except Exception as e:
+                logger.warning("[%s] ⚠️ Exception placing batch, placing orders one by one: %s", account_name, e)
+            # same orderLinkId on retry: if the batch did reach the exchange, Bybit rejects the duplicate.
+            # The legs are independent, so send them concurrently; the account's order bucket paces them.
+            if len(retry) > 1:
+                with concurrent.futures.ThreadPoolExecutor(max_workers=len(retry),
+                                                           thread_name_prefix=f"place_{account_name}") as legs:
+                    for _ in legs.map(lambda i: place_one(account_name, i, links[i]), retry):
+                        pass
+            elif retry:
+                place_one(account_name, retry[0], links[retry[0]])
+
+        # run placement for all accounts on a bounded pool (join before continuing):
+        # set up every account first (leverage must precede its orders), then one batch per account
+        with concurrent.futures.ThreadPoolExecutor(max_workers=min(len(keys_dict), 32) or 1,
+                                                   thread_name_prefix="place") as place_pool:
+            accounts = list(keys_dict.keys())
+            ready = [acc for acc, ok in zip(accounts, place_pool.map(setup_account, accounts, keys_dict.values())) if ok]
+            for _ in place_pool.map(place_account, ready):
+                pass
 
-                if stop_event.is_set():
-                    break
+        logger.debug("[DEBUG] ✅ All accounts placed orders.")
 
-                with lock:
-                    if order_link_id in processed_fills[account_name]:
-                        continue
-                    processed_fills[account_name].add(order_link_id)
+        # accounts where nothing could be placed have nothing to wait for
+        for acc in keys_dict.keys():
+            maybe_mark_done(acc)
 
-                limit_num = orderlinkid_to_limit.get(account_name, {}).get(order_link_id)
-                if limit_num is None:
-                    print(f"[{account_name}] ⚠️ Unknown orderLinkId {order_link_id} in TPSL worker")
+        # ---------- TPSL Worker: handles fills of tracked orderLinkIds (TP/SL itself rides on the orders) ----------
+        def tpsl_worker():
+            while not stop_event.is_set():
+                # fills only come from pending orders, so sleep long when there are none
+                # (unlocked read: a stale answer only changes how long we wait)
+                any_pending = any(state.pending for state in states.values())
+                batch = wait_fills(FILL_WAIT_ACTIVE if any_pending else FILL_WAIT_IDLE)
+                if not batch:
                     continue
 
-                tp = tpsl_dict.get(f"tp{limit_num}")
-                sl = tpsl_dict.get(f"sl{limit_num}")
-                if tp is None or sl is None:
-                    print(f"[{account_name}] ⚠️ Missing TP/SL for limit {limit_num}")
+                # coalesce: near-simultaneous fills on one account need a single TP/SL update
+                by_account = defaultdict(list)
+                for account_name, order_link_id in batch:
+                    by_account[account_name].append(order_link_id)
+                for account_name, order_link_ids in by_account.items():
+                    handle_fills(account_name, order_link_ids)
+
+        def handle_fills(account_name, order_link_ids):
+            """Record a batch of fills on one account and start its position monitor."""
+            st = states[account_name]
+            with st.lock:
+                fresh = [link for link in dict.fromkeys(order_link_ids) if link not in st.processed]
+                st.processed.update(fresh)
+
+            limit_nums = []
+            for order_link_id in fresh:
+                limit_num = st.link_to_limit.get(order_link_id)
+                if limit_num is None:
+                    logger.warning("[%s] ⚠️ Unknown orderLinkId %s in TPSL worker", account_name, order_link_id)
                     continue
-
-                # set trading stop (TP/SL) via manual signed POST
+                limit_nums.append(limit_num)
+
+            if limit_nums:
+                fill_done(account_name, sorted(limit_nums))
+
+            # no-op once the position is monitored; otherwise the fill may have been the last pending order
+            with st.lock:
+                st.in_flight.difference_update(order_link_ids)
+            maybe_mark_done(account_name)
+
+        def fill_done(account_name, limit_nums):
+            """Record fills and start the account's position monitor (TP/SL is armed by the order itself)."""
+            st = states[account_name]
+            label = "+".join(f"Limit{n}" for n in limit_nums)
+            with st.lock:
+                st.filled.extend(f"Limit{n}" for n in limit_nums)
+                start_monitor = not st.active_position
+                st.active_position = True
+            # limits fill in order; each carries Full-mode TP/SL, so the deepest one's now applies to the position
+            limit_num = limit_nums[-1]
+            tp = tps[limit_num - 1]
+            sl = sls[limit_num - 1]
+            if tp is None or sl is None:
+                logger.warning("[%s] ⚠️ %s filled without TP/SL (missing tp%s/sl%s).", account_name, label, limit_num, limit_num)
+            else:
+                logger.info("[%s] ✅ %s filled → TP/SL armed with the order (tp=%s sl=%s).", account_name, label, tp, sl)
+            # Hand the account to positions_worker if it isn't monitored yet
+            if start_monitor:
+                with position_cv:
+                    st.position_check_at = 0.0 if st.position_ready.is_set() else time.monotonic() + position_check_interval(st)
+                    monitored.add(account_name)
+                    position_cv.notify_all()
+
+        # ---------- Polling Worker: REST watchdog for fills the order stream missed ----------
+        def check_ws(acc):
+            """Drop a silent (zombie) order stream and reconnect a down one on its back-off schedule. True if down."""
+            st = states[acc]
+            ws = st.ws
+            ws_down = ws is None or not ws.is_connected()
+            if not ws_down and st.ws_last_seen and time.monotonic() - st.ws_last_seen > WS_STALE_AFTER:
+                # pybit pings every 20s and Bybit answers, so silence means a zombie connection
+                logger.warning("[%s] ⚠️ No WebSocket traffic for %.0fs, dropping the connection.",
+                               acc, time.monotonic() - st.ws_last_seen)
                 try:
-                    body = {
-                        "category": "linear",
-                        "symbol": tpsl_dict["symbol"],
-                        "takeProfit": str(tp),
-                        "stopLoss": str(sl),
-                        "positionIdx": 0
-                    }
-                    resp = rate_limited_request(account_name, actions[account_name]["set_trading_stop"], body)
-                    code = None
-                    if isinstance(resp, dict):
-                        code = resp.get("retCode")
-                    # Treat normal success (0) and "not modified" (34040) as okay
-                    if code in (0, 34040):
-                        with lock:
-                            final_summary[account_name]["filled"].append(f"Limit{limit_num}")
-                            active_position_flag[account_name] = True
-                        if code == 0:
-                            print(f"[{account_name}] ✅ Limit{limit_num} filled → TP/SL set (tp={tp} sl={sl}).")
-                        else:
-                            print(f"[{account_name}] ⚙️ Limit{limit_num} TP/SL already correct (not modified).")
-                        # Start position monitor for this account if not already running
-                        t = threading.Thread(target=position_monitor, args=(account_name,), name=f"posmon_{account_name}", daemon=False)
-                        t.start()
-                    else:
-                        print(f"[{account_name}] ⚠️ set_trading_stop failed: {resp}")
-                except Exception as e:
-                    print(f"[{account_name}] ⚠️ Error setting TP/SL for Limit{limit_num}: {e}")
+                    ws.exit()
+                except Exception:
+                    pass
+                ws_down = True
+                st.ws_retry_at = time.monotonic()  # known dead: reconnect now
+            if ws_down and st.reconnect_ws is not None:
+                now = time.monotonic()
+                if not st.ws_retry_at:
+                    # first sighting: reconnect after the current back-off interval
+                    st.ws_retry_at = now + st.ws_backoff + random.random() * WS_RECONNECT_JITTER
+                elif now >= st.ws_retry_at:
+                    logger.info("[%s] 🔌 Order stream down, reconnecting...", acc)
+                    st.reconnect_ws()
+            return ws_down
+
+        def poll_account(acc):
+            """Watch one account's stream and reconcile its pending orders over REST. True if its order stream is down."""
+            st = states[acc]
+            # the stream matters as long as the account is live, also while only a position is monitored
+            ws_down = check_ws(acc)
+            session = st.session
+            # skip if no session or no pending orders for this account
+            if session is None or not st.pending:
+                return ws_down
 
-        # ---------- Polling Worker: detect fills by orderLinkId ----------
-        def polling_worker():
-            processed = {acc: set() for acc in keys_dict.keys()}
+            try:
+                try:
+                    orders = fetch_open_orders_safe(session, symbol)
+                except Exception:
+                    orders = []
 
-            while not stop_event.is_set():
-                for acc in keys_dict.keys():
-                    if stop_event.is_set():
-                        break
-                    session = sessions.get(acc)
-                    if session is None:
+                found_links = set()
+                for order in orders:
+                    order_link = order.get("orderLinkId")
+                    status = order.get("orderStatus") or order.get("status") or order.get("order_status")
+                    if not order_link:
                         continue
+                    found_links.add(order_link)
 
-                    # skip if no pending orders for this account
-                    if not pending_orderlinks[acc]:
+                    if order_link not in st.link_to_limit:
                         continue
 
-                    try:
-                        try:
-                            orders = fetch_open_orders_safe(session, tpsl_dict["symbol"])
-                        except Exception:
-                            orders = []
-
-                        found_links = set()
-                        for order in orders:
-                            order_link = order.get("orderLinkId")
-                            status = order.get("orderStatus") or order.get("status") or order.get("order_status")
-                            if not order_link:
-                                continue
-                            found_links.add(order_link)
-
-                            if order_link not in orderlinkid_to_limit.get(acc, {}):
-                                continue
-
-                            # If filled, enqueue TPSL handling (only once)
-                            if str(status).lower() in ("filled", "complete", "closed"):
-                                if order_link not in processed[acc]:
-                                    processed[acc].add(order_link)
-                                    with lock:
-                                        pending_orderlinks[acc].discard(order_link)
-                                    fill_events.put((acc, order_link))
-                                    print(f"[DEBUG] [{acc}] Order {order_link} detected as filled (status={status}).")
-
-                        # Fallback: orders might disappear from open-orders when filled.
-                        missing = set(pending_orderlinks[acc]) - found_links
-                        if missing:
-                            for missing_link in list(missing):
-                                if stop_event.is_set():
-                                    break
-                                try:
-                                    history_fn = getattr(session, "get_order_history", None) or getattr(session, "query_order", None) or getattr(session, "query_active_order", None) or getattr(session, "get_orders", None)
-                                    if callable(history_fn):
-                                        resp = rate_limited_request(acc, history_fn,
-                                                                    category="linear",
-                                                                    symbol=tpsl_dict["symbol"],
-                                                                    orderLinkId=missing_link,
-                                                                    limit=20)
-                                        hist = []
-                                        if isinstance(resp, dict):
-                                            res = resp.get("result")
-                                            if isinstance(res, dict):
-                                                hist = res.get("list") or res.get("data") or []
-                                            elif isinstance(res, list):
-                                                hist = res
-                                        for rec in hist:
-                                            status = rec.get("orderStatus") or rec.get("status")
-                                            if str(status).lower() in ("filled", "complete", "closed"):
-                                                with lock:
-                                                    pending_orderlinks[acc].discard(missing_link)
-                                                fill_events.put((acc, missing_link))
-                                                print(f"[DEBUG] [{acc}] (history) Order {missing_link} detected as filled (status={status}).")
-                                                break
-                                except Exception as e:
-                                    print(f"[{acc}] ⚠️ Error checking history for {missing_link}: {e}")
+                    # If filled, enqueue TPSL handling (only once)
+                    if str(status).lower() in ("filled", "complete", "closed"):
+                        if claim_fill(acc, order_link):
+                            logger.debug("[DEBUG] [%s] Order %s detected as filled (status=%s).", acc, order_link, status)
 
+                # Fallback: orders might disappear from open-orders when filled.
+                # One symbol-wide history query per tick covers every missing link.
+                missing = set(st.pending) - found_links
+                if missing and not stop_event.is_set():
+                    try:
+                        history_fn = resolve_session_method(session, ORDER_HISTORY_METHODS)
+                        if callable(history_fn):
+                            resp = rate_limited_request(acc, history_fn,
+                                                        category="linear",
+                                                        symbol=symbol,
+                                                        limit=ORDER_HISTORY_LIMIT)
+                            for rec in _result_list(resp):
+                                order_link = rec.get("orderLinkId")
+                                if order_link not in missing:
+                                    continue
+                                status = rec.get("orderStatus") or rec.get("status")
+                                if str(status).lower() in ("filled", "complete", "closed"):
+                                    if claim_fill(acc, order_link):
+                                        logger.debug("[DEBUG] [%s] (history) Order %s detected as filled (status=%s).", acc, order_link, status)
                     except Exception as e:
-                        print(f"[{acc}] ⚠️ Error polling orders: {e}")
+                        logger.warning("[%s] ⚠️ Error checking order history: %s", acc, e)
 
-                # responsive sleep (breakable by stop_event)
-                for _ in range(10):
-                    if stop_event.is_set():
-                        break
-                    time.sleep(0.1)
+            except Exception as e:
+                logger.warning("[%s] ⚠️ Error polling orders: %s", acc, e)
+            return ws_down
 
-        # ---------- Position monitor: waits until position closes, then cancels remaining limits ----------
-        def position_monitor(account_name):
-            waited_for_position = False
-            while not stop_event.is_set():
-                if not active_position_flag.get(account_name):
-                    time.sleep(0.5)
-                    continue
+        def polling_worker():
+            interval = POLL_INTERVAL_MIN
+            # accounts are polled in parallel (each still throttled by its own bucket), so a cycle
+            # costs the slowest account's round trip instead of the sum over all accounts
+            with concurrent.futures.ThreadPoolExecutor(max_workers=min(len(keys_dict), 16) or 1,
+                                                       thread_name_prefix="poll") as pool:
+                while not stop_event.is_set():
+                    # accounts without a live order stream are polled every POLL_INTERVAL_MIN; while all
+                    # streams are healthy we only reconcile, backing off 1s -> 2s -> ... -> POLL_INTERVAL_MAX
+                    work = [acc for acc, st in states.items() if st.reconnect_ws is not None and not st.done]
+                    ws_down = any(pool.map(poll_account, work))
+
+                    interval = POLL_INTERVAL_MIN if ws_down else min(interval * 2, POLL_INTERVAL_MAX)
+
+                    # responsive sleep: returns as soon as stop_event is set
+                    if stop_event.wait(interval):
+                        break
 
-                try:
-                    pos_resp = rate_limited_request(account_name, sessions[account_name].get_positions,
-                                                    category="linear", symbol=tpsl_dict["symbol"])
-                    positions = pos_resp.get("result", {}).get("list", [])
-                    size = 0.0
-                    if positions:
-                        try:
-                            size = float(positions[0].get("size", 0))
-                        except Exception:
-                            size = 0.0
-                    if not waited_for_position:
-                        if size > 0:
-                            waited_for_position = True
-                            print(f"[{account_name}] 🔎 Position detected (size={size}). Now monitoring for close (TP/SL).")
+        # ---------- Cancel remaining limits (one cancel-all call per account) ----------
+        def cancel_batch(account_name):
+            """Cancel the account's pending links with one cancel-batch request. Returns the links Bybit cancelled."""
+            st = states[account_name]
+            with st.lock:
+                links = sorted(st.pending, key=st.link_to_limit.get)
+            body = {"category": "linear", "request": [{"symbol": symbol, "orderLinkId": link} for link in links]}
+            resp = st.calls["cancel_batch_order"](body)
+            if not (isinstance(resp, dict) and resp.get("retCode") == 0):
+                logger.warning("[%s] ⚠️ cancel_batch_order failed: %s", account_name, resp)
+                return set()
+            # per-leg outcome: retExtInfo.list codes line up with result.list
+            codes = (resp.get("retExtInfo") or {}).get("list") or ()
+            return {row.get("orderLinkId") for n, row in enumerate(_result_list(resp))
+                    if n >= len(codes) or codes[n].get("code") == 0} - {None, ""}
+
+        def cancel_remaining(account_name):
+            """
+            Cancel all open limit orders on the symbol with a single cancel-all request and mark the
+            pending links it reports as canceled. Returns the links marked canceled.
+            """
+            st = states[account_name]
+            with st.lock:
+                if not st.pending:
+                    return []
+            # orderFilter=Order leaves conditional/TP-SL orders alone
+            cancel_body = {"category": "linear", "symbol": symbol, "orderFilter": "Order"}
+            try:
+                resp = st.calls["cancel_all_orders"](cancel_body)
+            except Exception as e:
+                resp = e
+            if isinstance(resp, dict) and resp.get("retCode") == 0:
+                # result.list names the orders actually cancelled; a pending link missing from it (or from
+                # an empty list) filled in the meantime and stays pending so its fill is still claimed.
+                # Only a response without any list leaves us guessing: then everything pending is assumed cancelled.
+                result = resp.get("result")
+                rows = result.get("list") if isinstance(result, dict) else result
+                returned = {row.get("orderLinkId") for row in rows} if isinstance(rows, list) else None
+            else:
+                logger.warning("[%s] ⚠️ cancel_all_orders failed, cancelling by orderLinkId: %s", account_name, resp)
+                returned = cancel_batch(account_name)
+                if not returned:
+                    return []
+            with st.lock:
+                if returned is not None:
+                    canceled = sorted(st.pending & returned, key=st.link_to_limit.get)
+                    st.pending.difference_update(canceled)
+                else:
+                    canceled = sorted(st.pending, key=st.link_to_limit.get)
+                    st.pending.clear()
+                st.canceled.extend(canceled)
+            return canceled
+
+        # ---------- Position monitor: waits until positions close, then cancels remaining limits ----------
+        def position_check_interval(st):
+            """Seconds until the next REST position check: long while the position stream is live."""
+            ws = st.ws
+            return POSITION_RECONCILE_INTERVAL if ws is not None and ws.is_connected() else POSITION_POLL_INTERVAL
+
+        def check_position(account_name):
+            """
+            One REST get_positions check for a monitored account: advance it from waiting-for-open to
+            waiting-for-close, and on close cancel the remaining limits and stop monitoring it.
+            """
+            st = states[account_name]
+            # the stream already reports the awaited transition; if REST disagrees, it is only lagging
+            stream_ahead = (st.position_closed if st.position_opened else st.position_ready).is_set()
+            # fills recorded after this point belong to a position the REST read below may not show yet
+            with st.lock:
+                fills_seen = len(st.filled)
+            try:
+                pos_resp = st.calls["get_positions"](category="linear", symbol=symbol)
+                positions = _result_list(pos_resp)
+                size = _position_size(positions[0]) if positions else 0.0
+            except Exception as e:
+                logger.warning("[%s] ⚠️ Error fetching positions: %s", account_name, e)
+                delay = POSITION_POLL_INTERVAL
+            else:
+                if not st.position_opened and size > 0:
+                    st.position_opened = True
+                    logger.info("[%s] 🔎 Position detected (size=%s). Now monitoring for close (TP/SL).", account_name, size)
+                    delay = 0.0 if st.position_closed.is_set() else position_check_interval(st)
+                elif st.position_opened and size == 0:
+                    logger.info("[%s] ✅ Position closed (TP/SL hit or manual close). Cancelling remaining limit orders...", account_name)
+                    try:
+                        canceled = cancel_remaining(account_name)
+                        if canceled:
+                            logger.info("[%s] ❌ Cancelled leftover orders %s after position closed.", account_name, canceled)
+                    except Exception as e:
+                        logger.warning("[%s] ⚠️ Error during cancel-after-close: %s", account_name, e)
+
+                    # one critical section with fill_done: a limit that filled since the REST read (or is
+                    # claimed but not yet recorded) opened a new position, so keep monitoring instead
+                    with st.lock:
+                        rearm = len(st.filled) != fills_seen or bool(st.in_flight)
+                        with position_cv:
+                            st.position_opened = False
+                            st.position_closed.clear()
+                            if rearm:
+                                st.position_check_at = 0.0
+                                position_cv.notify_all()
+                            else:
+                                st.position_ready.clear()
+                                monitored.discard(account_name)
+                                st.active_position = False
+                    if rearm:
+                        logger.info("[%s] 🔎 A limit filled during close-out; monitoring the new position.", account_name)
+                        return
+                    maybe_mark_done(account_name)
+                    return
+                else:
+                    # the stream is ahead of REST: re-check shortly instead of spinning on the set event
+                    delay = POSITION_POLL_INTERVAL if stream_ahead else position_check_interval(st)
+            with position_cv:
+                # a stream update during the check already asked for an immediate one
+                if st.position_check_at != 0.0 or delay == 0.0:
+                    st.position_check_at = time.monotonic() + delay
+
+        def positions_worker():
+            """
+            Single monitor for every account with a filled order. The position stream drives the checks
+            via position_cv; REST get_positions confirms them and reconciles while a stream is down.
+            """
+            with concurrent.futures.ThreadPoolExecutor(max_workers=min(len(keys_dict), 16) or 1,
+                                                       thread_name_prefix="posmon") as pool:
+                while not stop_event.is_set():
+                    with position_cv:
+                        now = time.monotonic()
+                        due = [acc for acc in monitored if states[acc].position_check_at <= now]
+                        if not due:
+                            next_at = min((states[acc].position_check_at for acc in monitored), default=None)
+                            # no periodic wake-ups while nothing is monitored
+                            position_cv.wait(None if next_at is None else next_at - now)
+                            continue
+                        for acc in due:
+                            states[acc].position_check_at = float("inf")  # claimed; rescheduled by check_position
+                    if len(due) == 1:
+                        check_position(due[0])
                     else:
-                        if size == 0:
-                            print(f"[{account_name}] ✅ Position closed (TP/SL hit or manual close). Cancelling remaining limit orders...")
-                            try:
-                                with lock:
-                                    to_cancel = list(pending_orderlinks[account_name])
-                                for link in to_cancel:
-                                    try:
-                                        cancel_body = {"category":"linear","symbol":tpsl_dict["symbol"], "orderLinkId": link}
-                                        resp = rate_limited_request(account_name, actions[account_name]["cancel_order"], cancel_body)
-                                        with lock:
-                                            final_summary[account_name]["canceled"].append(link)
-                                            pending_orderlinks[account_name].discard(link)
-                                        print(f"[{account_name}] ❌ Cancelled leftover order {link} after position closed. resp={resp}")
-                                    except Exception as e:
-                                        print(f"[{account_name}] ⚠️ Error cancelling {link}: {e}")
-                            except Exception as e:
-                                print(f"[{account_name}] ⚠️ Error during cancel-after-close: {e}")
-
-                            with lock:
-                                active_position_flag[account_name] = False
-                            return
+                        list(pool.map(check_position, due))
+
+        # ---------- Keepalive: stop idle pooled connections from going cold between orders ----------
+        def keepalive_worker():
+            # both pools are shared by every account, so one cheap public GET each per interval suffices
+            ready = [st for st in states.values() if st.session is not None]
+            if not ready:
+                return
+            session = ready[0].session
+            time_url = f"{ready[0].actions['base_url']}/v5/market/time"
+            while not stop_event.wait(HTTP_KEEPALIVE_INTERVAL):
+                try:
+                    session.get_server_time()                       # pybit client pool (GETs)
+                    _rest_session.get(time_url, timeout=5).close()  # signed-POST pool
                 except Exception as e:
-                    print(f"[{account_name}] ⚠️ Error fetching positions: {e}")
-                for _ in range(5):
-                    if stop_event.is_set():
-                        break
-                    time.sleep(0.2)
+                    logger.debug("[DEBUG] Keepalive request failed: %s", e)
 
         # ---------- Start background threads ----------
         threads = []
@@ -616,116 +1377,189 @@ def trade_tcl(keys_dict, order_dict, tpsl_dict, demo=True, max_wait_seconds=300)
         t_tpsl.start()
         threads.append(t_tpsl)
 
-        # ---------- User cancel listener ----------
-        def listen_for_cancel():
-            while True:
-                try:
-                    user_input = input().strip().lower()
-                except Exception:
-                    # input might be closed in some contexts
-                    break
-                if user_input == "cancel":
-                    cancel_requested["flag"] = True
-                    print("[DEBUG] Cancel requested by user.")
-                    break
+        t_positions = threading.Thread(target=positions_worker, name="positions_worker", daemon=False)
+        t_positions.start()
+        threads.append(t_positions)
 
-        t_listen = threading.Thread(target=listen_for_cancel, name="listen_for_cancel", daemon=False)
-        t_listen.start()
-        threads.append(t_listen)
-
-        # ---------- Monitor/Controller loop ----------
-        try:
-            while True:
-                all_done = True
-                now = time.time()
+        t_keepalive = threading.Thread(target=keepalive_worker, name="keepalive_worker", daemon=False)
+        t_keepalive.start()
+        threads.append(t_keepalive)
 
-                for acc in keys_dict.keys():
-                    if final_summary[acc]["done"]:
-                        continue
+        # ---------- User cancel: Ctrl+C (SIGINT) or a "cancel" line on stdin ----------
+        # No listener thread: the controller below multiplexes stdin with a wake-up socket that is
+        # written whenever an account future (or the cancel sentinel) resolves.
+        wake_r, wake_w = socket.socketpair()
+        wake_r.setblocking(False)
 
-                    if cancel_requested["flag"]:
-                        print(f"[{acc}] ⛔ User requested cancel. Cancelling outstanding orders and closing positions...")
-                        try:
-                            with lock:
-                                to_cancel = [o.get("orderLinkId") for o in results.get(acc, []) if o.get("orderLinkId")]
-                            for olnk in to_cancel:
-                                try:
-                                    cancel_body = {"category":"linear","symbol":tpsl_dict["symbol"], "orderLinkId":olnk}
-                                    resp = rate_limited_request(acc, actions[acc]["cancel_order"], cancel_body)
-                                    with lock:
-                                        final_summary[acc]["canceled"].append(olnk)
-                                except Exception as e:
-                                    print(f"[{acc}] ⚠️ Error cancelling {olnk}: {e}")
-                            # close positions (if any) using manual signed POST market close
-                            pos_info = rate_limited_request(acc, sessions[acc].get_positions,
-                                                            category="linear", symbol=tpsl_dict["symbol"])
-                            for p in pos_info.get("result", {}).get("list", []):
-                                size = float(p.get("size", 0))
-                                side = p.get("side")
-                                if size > 0:
-                                    close_side = "Sell" if side == "Buy" else "Buy"
-                                    close_body = {
-                                        "category":"linear",
-                                        "symbol": tpsl_dict["symbol"],
-                                        "side": close_side,
-                                        "orderType": "Market",
-                                        "qty": str(size),
-                                        "reduceOnly": True,
-                                        "timeInForce":"GTC",
-                                        "orderLinkId": f"close_{acc}_{int(time.time()*1000)}"
-                                    }
-                                    resp = rate_limited_request(acc, actions[acc]["place_order"], close_body)
-                                    print(f"[{acc}] 🛑 Close resp: {resp}")
-                        except Exception as e:
-                            print(f"[{acc}] ⚠️ Error during cancel sequence: {e}")
-                        final_summary[acc]["user_cancel"] = True
-                        final_summary[acc]["done"] = True
-                        stop_event.set()
-                        continue
+        def wake(_future=None):
+            try:
+                wake_w.send(b"\0")
+            except OSError:
+                pass
 
-                    # timeout handling (per-account)
-                    if order_timestamps.get(acc) and now - order_timestamps[acc] > max_wait_seconds:
-                        print(f"[{acc}] ⏳ Timeout reached, cancelling remaining orders.")
-                        try:
-                            with lock:
-                                to_cancel = [o.get("orderLinkId") for o in results.get(acc, []) if o.get("orderLinkId")]
-                            for olnk in to_cancel:
-                                try:
-                                    cancel_body = {"category":"linear","symbol":tpsl_dict["symbol"], "orderLinkId":olnk}
-                                    resp = rate_limited_request(acc, actions[acc]["cancel_order"], cancel_body)
-                                    with lock:
-                                        final_summary[acc]["canceled"].append(olnk)
-                                except Exception as e:
-                                    print(f"[{acc}] ⚠️ Error cancelling {olnk}: {e}")
-                        except Exception as e:
-                            print(f"[{acc}] ⚠️ Error during timeout cancel: {e}")
-                        final_summary[acc]["timeout"] = True
-                        final_summary[acc]["done"] = True
-                        continue
+        for f in [st.future for st in states.values()] + [cancel_future]:
+            f.add_done_callback(wake)
+
+        def request_cancel():
+            with lock:
+                if cancel_future.done():
+                    return
+                cancel_future.set_result(True)
+            logger.debug("[DEBUG] Cancel requested by user.")
+
+        def on_sigint(signum, frame):
+            if cancel_future.done():
+                # second Ctrl+C: give up on the graceful cancel
+                raise KeyboardInterrupt
+            request_cancel()
+
+        prev_sigint = None
+        if threading.current_thread() is threading.main_thread():
+            prev_sigint = signal.signal(signal.SIGINT, on_sigint)
+
+        selector = selectors.DefaultSelector()
+        selector.register(wake_r, selectors.EVENT_READ)
+        console_poll = False
+        if sys.platform == "win32":
+            # Windows select() only takes sockets (register() would accept stdin and select() then
+            # fail), so poll the console keyboard between selector waits instead
+            console_poll = msvcrt is not None and sys.stdin is not None and sys.stdin.isatty()
+        else:
+            try:
+                # not possible when stdin is a regular file / closed
+                selector.register(sys.stdin, selectors.EVENT_READ)
+            except (ValueError, OSError, AttributeError, TypeError):
+                pass
+        console_buf = []
+
+        def read_stdin_command():
+            line = sys.stdin.readline()
+            if not line:
+                # EOF: nothing more will be typed
+                selector.unregister(sys.stdin)
+            elif line.strip().lower() == "cancel":
+                request_cancel()
+
+        def poll_console():
+            while msvcrt.kbhit():
+                ch = msvcrt.getwche()
+                if ch in "\r\n":
+                    line = "".join(console_buf)
+                    console_buf.clear()
+                    if line.strip().lower() == "cancel":
+                        request_cancel()
+                else:
+                    console_buf.append(ch)
+
+        # ---------- Cancel helper (user cancel / timeout) ----------
+        def cancel_and_flatten(acc, reason):
+            """Cancel the account's remaining orders; on user cancel also market-close any open position."""
+            st = states[acc]
+            # the position monitor may have finished the account (and cancelled its leftovers) meanwhile
+            if st.done:
+                return
+            try:
+                # only still-pending links are cancelled; ones already filled/cancelled are skipped
+                cancel_remaining(acc)
+                if reason == "user_cancel":
+                    # close positions (if any) using manual signed POST market close
+                    pos_info = st.calls["get_positions"](category="linear", symbol=symbol)
+                    for p in _result_list(pos_info):
+                        if _position_size(p) <= 0:
+                            continue
+                        close_side = _OPP.get(p.get("side"))
+                        if close_side is None:
+                            logger.warning("[%s] ⚠️ Unknown position side %r, not closing.", acc, p.get("side"))
+                            continue
+                        close_body = {
+                            "category":"linear",
+                            "symbol": symbol,
+                            "side": close_side,
+                            "orderType": "Market",
+                            "qty": str(p.get("size")),  # exchange's own string, no float repr
+                            "reduceOnly": True,
+                            "timeInForce":"GTC",
+                            "orderLinkId": f"close_{acc}_{int(time.time()*1000)}"
+                        }
+                        resp = st.calls["place_order"](close_body)
+                        logger.info("[%s] 🛑 Close resp: %s", acc, resp)
+            except Exception as e:
+                logger.warning("[%s] ⚠️ Error during %s cancel: %s", acc, reason, e)
+            mark_done(acc, **{reason: True})
+
+        def cancel_accounts(accounts, reason):
+            """Run cancel_and_flatten for several accounts at once (each paced by its own buckets)."""
+            if len(accounts) > 1:
+                with concurrent.futures.ThreadPoolExecutor(max_workers=min(len(accounts), 32),
+                                                           thread_name_prefix="cancel") as cancel_pool:
+                    for _ in cancel_pool.map(lambda acc: cancel_and_flatten(acc, reason), accounts):
+                        pass
+            elif accounts:
+                cancel_and_flatten(accounts[0], reason)
+
+        # ---------- Monitor/Controller: block on stdin + future wake-ups until the next deadline ----------
+        # monotonic: time.time() is NTP-patched for this run and may jump when the offset is applied
+        run_deadline = time.monotonic() + max_wait_seconds
+
+        # (deadline, account) min-heap: the controller sleeps exactly until the earliest timeout
+        deadlines = [(st.deadline or run_deadline, acc) for acc, st in states.items()]
+        heapq.heapify(deadlines)
 
-                    # if there are pending orders or active position, we are not done yet
-                    if pending_orderlinks[acc] or active_position_flag[acc]:
-                        all_done = False
-                    else:
-                        final_summary[acc]["done"] = True
+        try:
+            while True:
+                # accounts that finished on their own no longer need a timeout
+                while deadlines and states[deadlines[0][1]].future.done():
+                    heapq.heappop(deadlines)
+                if not deadlines:
+                    break
 
-                if all_done:
-                    stop_event.set()
+                if cancel_future.done():
+                    open_accounts = [acc for acc, st in states.items() if not st.future.done()]
+                    for acc in open_accounts:
+                        logger.info("[%s] ⛔ User requested cancel. Cancelling outstanding orders and closing positions...", acc)
+                    cancel_accounts(open_accounts, "user_cancel")
                     break
 
-                # responsive sleep
-                for _ in range(10):
-                    if stop_event.is_set():
-                        break
-                    time.sleep(0.1)
+                timeout = max(0.0, deadlines[0][0] - time.monotonic())
+                if console_poll:
+                    timeout = min(timeout, CONSOLE_POLL_INTERVAL)
+                for key, _ in selector.select(timeout):
+                    if key.fileobj is wake_r:
+                        try:
+                            while wake_r.recv(512):
+                                pass
+                        except OSError:
+                            pass
+                    else:
+                        read_stdin_command()
+                if console_poll:
+                    poll_console()
+
+                # timeout handling (per-account)
+                now = time.monotonic()
+                expired = []
+                while deadlines and deadlines[0][0] <= now:
+                    _, acc = heapq.heappop(deadlines)
+                    if not states[acc].future.done():
+                        logger.info("[%s] ⏳ Timeout reached, cancelling remaining orders.", acc)
+                        expired.append(acc)
+                cancel_accounts(expired, "timeout")
 
         except KeyboardInterrupt:
-            print("[DEBUG] KeyboardInterrupt received, stopping.")
-            stop_event.set()
+            logger.debug("[DEBUG] KeyboardInterrupt received, stopping.")
         except Exception as e:
-            print("[DEBUG] Unexpected exception in controller loop:", e)
-            traceback.print_exc()
+            logger.exception("[DEBUG] Unexpected exception in controller loop: %s", e)
+        finally:
             stop_event.set()
+            with fill_cond:
+                fill_cond.notify_all()
+            with position_cv:
+                position_cv.notify_all()
+            if prev_sigint is not None:
+                signal.signal(signal.SIGINT, prev_sigint)
+            selector.close()
+            wake_r.close()
+            wake_w.close()
 
         # ------- Clean up threads and sessions -------
         # Wait for threads to exit (with timeout). Threads created locally are non-daemon so they should exit quickly.
@@ -736,25 +1570,26 @@ def trade_tcl(keys_dict, order_dict, tpsl_dict, demo=True, max_wait_seconds=300)
                 except Exception:
                     pass
 
-        # Also join any position monitor threads (they were created dynamically)
-        # We attempt to be defensive: iterate over threading.enumerate() and join any named posmon_* or place_* threads
+        # Also join any leftover executor workers (position checks, placement, cancels)
+        # We attempt to be defensive: iterate over threading.enumerate() and join any named posmon_*, place_* or cancel_* threads
         for t in threading.enumerate():
-            if t.name.startswith(("posmon_", "place_")) and t is not threading.current_thread():
+            if t.name.startswith(("posmon_", "place_", "cancel_")) and t is not threading.current_thread():
                 try:
                     t.join(timeout=1)
                 except Exception:
                     pass
 
-        # Close sessions if possible
-        for acc, s in list(sessions.items()):
+        # Close private WebSockets (their pybit threads are daemons, but sockets should not linger)
+        for st in states.values():
+            if st.ws is None:
+                continue
             try:
-                # pybit HTTP wrapper may hold a requests.Session in attribute 'session' or 'http'
-                sess_obj = getattr(s, "session", None) or getattr(s, "http", None)
-                if hasattr(sess_obj, "close"):
-                    sess_obj.close()
+                st.ws.exit()
             except Exception:
                 pass
 
+        # pybit HTTP sessions are not closed: they are cached by get_http() for the next run
+
         # final garbage collect
         try:
             gc.collect()
@@ -762,6 +1597,8 @@ def trade_tcl(keys_dict, order_dict, tpsl_dict, demo=True, max_wait_seconds=300)
             pass
 
     # after exiting 'with', restored original time()
-    print("[DEBUG] Exiting trade_tcl, summary:")
-    print(json.dumps(final_summary, indent=2))
+    final_summary = {acc: st.summary() for acc, st in states.items()}
+    logger.debug("[DEBUG] Exiting trade_tcl, summary:")
+    if logger.isEnabledFor(logging.INFO):  # don't pay for the pretty-print when INFO is off
+        logger.info("%s", json.dumps(final_summary, indent=2))
     return final_summary